@@ -6,7 +6,11 @@ from datetime import datetime, date
 import io
 import re
 import calendar
-from typing import Optional, Set, Tuple, List, Dict
+import functools
+import hashlib
+import importlib.util
+from collections import defaultdict, namedtuple
+from typing import Optional, Set, FrozenSet, Tuple, List, Dict
 
 st.set_page_config(page_title="E2B_R3 XML Triage Application", layout="wide")
 # Ensure multi-line cells render properly
@@ -35,21 +39,36 @@ with st.expander("\U0001F4D6 Instructions"):
 - Parsed data appears in the **Export & Edit** tab. **All columns are read-only.**
 """)
 
+_NON_DIGIT_RE = re.compile(r"\D")
+_ALNUM_RE = re.compile(r"[A-Za-z0-9]")
+
 def _digits_only(s: str) -> str:
-    return re.sub(r"\D", "", (s or "").strip())
+    return _NON_DIGIT_RE.sub("", (s or "").strip())
+
+def _date_digits(date_str: str) -> str:
+    """Leading date digits (at most YYYYMMDD) of an HL7 timestamp.
+
+    HL7 TS values nearly always start with eight ASCII digits, which are taken as-is; anything
+    else (separators, short values) goes through the regex digit filter.
+    """
+    head = date_str.strip()[:8]
+    if len(head) == 8 and head.isascii() and head.isdigit():
+        return head
+    return _digits_only(date_str)[:8]
 
+@functools.lru_cache(maxsize=4096)
 def format_date(date_str: str) -> str:
     if not date_str:
         return ""
-    digits = _digits_only(date_str)
+    digits = _date_digits(date_str)
     try:
         if len(digits) >= 8:
-            dt = datetime.strptime(digits[:8], "%Y%m%d").date()
+            dt = date(int(digits[:4]), int(digits[4:6]), int(digits[6:8]))
             return dt.strftime("%d-%b-%Y")
         elif len(digits) >= 6:
             year = int(digits[:4])
             month = int(digits[4:6])
-            return datetime(year, month, 1).strftime("%b-%Y")
+            return date(year, month, 1).strftime("%b-%Y")
         elif len(digits) >= 4:
             year = int(digits[:4])
             return f"{year}"
@@ -58,47 +77,48 @@ def format_date(date_str: str) -> str:
     except Exception:
         return ""
 
+@functools.lru_cache(maxsize=4096)
 def parse_date_obj(date_str: str) -> Optional[date]:
     if not date_str:
         return None
-    digits = _digits_only(date_str)
+    digits = _date_digits(date_str)
     try:
         if len(digits) >= 8:
-            return datetime.strptime(digits[:8], "%Y%m%d").date()
+            return date(int(digits[:4]), int(digits[4:6]), int(digits[6:8]))
         elif len(digits) >= 6:
             year = int(digits[:4])
             month = int(digits[4:6])
             last_day = calendar.monthrange(year, month)[1]
-            return datetime(year, month, last_day).date()
+            return date(year, month, last_day)
         elif len(digits) >= 4:
             year = int(digits[:4])
-            return datetime(year, 12, 31).date()
+            return date(year, 12, 31)
         else:
             return None
     except Exception:
         return None
 
-def map_reporter(code):
-    return {
-        "1": "Physician",
-        "2": "Pharmacist",
-        "3": "Other health professional",
-        "4": "Lawyer",
-        "5": "Consumer or other non-health professional"
-    }.get(code, "Unknown")
-
-def map_gender(code):
-    return {"1": "Male", "2": "Female"}.get(code, "Unknown")
-
-def map_outcome(code):
-    return {
-        "1": "Recovered/Resolved",
-        "2": "Recovering/Resolving",
-        "3": "Not recovered/Ongoing",
-        "4": "Recovered with sequelae",
-        "5": "Fatal",
-        "0": "Unknown"
-    }.get(code, "Unknown")
+REPORTER_MAP = {
+    "1": "Physician",
+    "2": "Pharmacist",
+    "3": "Other health professional",
+    "4": "Lawyer",
+    "5": "Consumer or other non-health professional"
+}
+
+GENDER_MAP = {"1": "Male", "2": "Female"}
+
+OUTCOME_MAP = {
+    "1": "Recovered/Resolved",
+    "2": "Recovering/Resolving",
+    "3": "Not recovered/Ongoing",
+    "4": "Recovered with sequelae",
+    "5": "Fatal",
+    "0": "Unknown"
+}
+
+AGE_GROUP_MAP = {"0": "Foetus", "1": "Neonate", "2": "Infant", "3": "Child", "4": "Adolescent", "5": "Adult", "6": "Elderly"}
+MASKED_FLAVORS = frozenset({"MSK", "UNK", "ASKU", "NI"})
 
 AGE_UNIT_MAP = {"a": "year", "b": "month"}
 
@@ -108,25 +128,50 @@ def map_age_unit(raw_unit: str) -> str:
     ru = str(raw_unit).strip().lower()
     return AGE_UNIT_MAP.get(ru, ru)
 
-UNKNOWN_TOKENS = {"unk", "asku", "unknown"}
+UNKNOWN_TOKENS = frozenset({"unk", "asku", "unknown"})
 
 def is_unknown(value: str) -> bool:
     if value is None:
         return True
-    v = str(value).strip()
+    v = (value if type(value) is str else str(value)).strip()
     if not v:
         return True
     return v.lower() in UNKNOWN_TOKENS
 
 def clean_value(value: str) -> str:
+    # Inlined str fast path: XML text and attribute values are always str.
+    if type(value) is str:
+        v = value.strip()
+        return "" if not v or v.lower() in UNKNOWN_TOKENS else value
     return "" if is_unknown(value) else str(value)
 
-def normalize_text(s: str) -> str:
-    s = (s or "").lower()
-    s = re.sub(r'[^a-z0-9\s\+\-]', ' ', s)
-    s = re.sub(r'\s+', ' ', s).strip()
+_NORM_STRIP_RE = re.compile(r'[^a-z0-9\s\+\-]')
+_NORM_WS_RE = re.compile(r'\s+')
+
+# LLT terms and product names repeat heavily across events and cases.
+@functools.lru_cache(maxsize=8192)
+def _normalize_text_cached(s: str) -> str:
+    s = s.lower()
+    s = _NORM_STRIP_RE.sub(' ', s)
+    s = _NORM_WS_RE.sub(' ', s).strip()
     return s
 
+def normalize_text(s: str) -> str:
+    # Empty/None inputs are common (missing terms) and never reach the cache.
+    if not s:
+        return ""
+    return _normalize_text_cached(s)
+
+def normalize_series(col: pd.Series) -> pd.Series:
+    """normalize_text over a whole column with pandas' vectorized string methods."""
+    return (
+        # Arrow lowercases U+0130 to a bare "i"; str.lower() gives "i" + combining dot.
+        col.astype(str).str.replace("\u0130", "i\u0307", regex=False).str.lower()
+        .str.replace(_NORM_STRIP_RE, ' ', regex=True)
+        .str.replace(_NORM_WS_RE, ' ', regex=True)
+        .str.strip()
+    )
+
 # --- Listedness helpers ---
 def to_pair_set(df: pd.DataFrame) -> Set[Tuple[str, str]]:
     """Build a set of normalized (drug, llt) pairs from columns 'Drug Name', 'LLT'."""
@@ -139,13 +184,59 @@ def to_pair_set(df: pd.DataFrame) -> Set[Tuple[str, str]]:
     if not drug_col or not llt_col:
         st.warning("Listedness file must have columns: 'Drug Name' and 'LLT'.")
         return pairs
-    for _, row in df[[drug_col, llt_col]].dropna(how='any').iterrows():
-        drug = normalize_text(str(row[drug_col]))
-        llt = normalize_text(str(row[llt_col]))
-        if drug and llt:
-            pairs.add((drug, llt))
+    rows = df[[drug_col, llt_col]].dropna(how='any')
+    drugs = normalize_series(rows[drug_col])
+    llts = normalize_series(rows[llt_col])
+    keep = drugs.ne('') & llts.ne('')
+    pairs.update(zip(drugs[keep], llts[keep]))
     return pairs
 
+EMPTY_LLTS: FrozenSet[str] = frozenset()
+
+def index_pairs_by_product(pairs: Set[Tuple[str, str]]) -> Dict[str, FrozenSet[str]]:
+    """Group normalized (drug, llt) pairs into {drug: frozenset of listed LLTs}."""
+    grouped: Dict[str, Set[str]] = defaultdict(set)
+    for drug, llt in pairs:
+        grouped[drug].add(llt)
+    return {drug: frozenset(llts) for drug, llts in grouped.items()}
+
+# Read uploads with the Rust calamine reader when installed; openpyxl otherwise.
+EXCEL_READER_ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_listed_by_product(data: bytes) -> Dict[str, FrozenSet[str]]:
+    """Read a listedness workbook into {drug: frozenset of listed LLTs}, cached on the file bytes."""
+    return index_pairs_by_product(to_pair_set(pd.read_excel(io.BytesIO(data), engine=EXCEL_READER_ENGINE)))
+
+# --- MedDRA mapping helpers ---
+def build_llt_map(mapping_df: pd.DataFrame) -> Dict[str, Tuple[str, str, str]]:
+    """{LLT Code: (LLT Term, PT Term, normalized LLT Term)}, first row winning for repeated codes.
+    Raises KeyError if one of the three columns is missing."""
+    for column in ('LLT Code', 'LLT Term', 'PT Term'):
+        if column not in mapping_df.columns:
+            raise KeyError(column)
+    first_rows = mapping_df.drop_duplicates(subset='LLT Code', keep='first')
+    # map(str) rather than astype(str): blank cells must become "nan" like str() gives, not stay NaN.
+    llt_terms = first_rows['LLT Term'].map(str)
+    pt_terms = first_rows['PT Term'].map(str)
+    return dict(zip(first_rows['LLT Code'], zip(llt_terms, pt_terms, normalize_series(llt_terms))))
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_llt_map(data: bytes) -> Tuple[Dict[str, Tuple[str, str, str]], Optional[KeyError]]:
+    """Read an LLT mapping workbook into (llt_map, error), cached on the file bytes.
+
+    A workbook missing one of the required columns yields an empty map and the KeyError.
+    """
+    mapping_df = pd.read_excel(io.BytesIO(data), engine=EXCEL_READER_ENGINE)
+    if "LLT Code" in mapping_df.columns:
+        # Arrow-backed strings regardless of the pandas default; rows without a code can never match.
+        mapping_df = mapping_df.astype({"LLT Code": "string[pyarrow]"}).dropna(subset=["LLT Code"])
+        mapping_df["LLT Code"] = mapping_df["LLT Code"].str.strip()
+    try:
+        return build_llt_map(mapping_df), None
+    except KeyError as e:
+        return {}, e
+
 # PL pattern e.g., "PL 12345/6789", "PLGB 12345/6789"
 PL_PATTERN = re.compile(r'\b(PL|PLGB|PLNI)\s*([0-9]{5})\s*/\s*([0-9]{4,5})\b', re.IGNORECASE)
 
@@ -163,17 +254,23 @@ def extract_pl_numbers(text: str):
 MY_COMPANY_NAME = "celix"
 DEFAULT_COMPETITOR_NAMES = {"glenmark", "cipla", "sun pharma", "dr reddy", "dr. reddy", "torrent", "lupin", "intas", "mankind", "micro labs", "zydus"}
 
-def contains_competitor_name(lot_text: str, competitor_names: Set[str]) -> bool:
+@functools.lru_cache(maxsize=16)
+def competitor_pattern(competitor_names: FrozenSet[str]) -> Optional["re.Pattern[str]"]:
+    """One alternation over the lowercased competitor names (plain substring match), or None if empty."""
+    names = {(name or "").lower().strip() for name in competitor_names}
+    names.discard("")
+    if not names:
+        return None
+    return re.compile("|".join(re.escape(nm) for nm in sorted(names, key=len, reverse=True)))
+
+def contains_competitor_name(lot_text: str, competitor_names: FrozenSet[str]) -> bool:
     if not lot_text:
         return False
     norm = lot_text.lower()
     if MY_COMPANY_NAME.lower() in norm:
         return False
-    for name in competitor_names:
-        nm = (name or "").lower().strip()
-        if nm and nm in norm:
-            return True
-    return False
+    pattern = competitor_pattern(competitor_names)
+    return pattern is not None and pattern.search(norm) is not None
 
 company_products = [
     "abiraterone", "apixaban", "apremilast", "bexarotene", "clobazam", "clonazepam",
@@ -190,6 +287,27 @@ category2_products = {
     "luteum", "amelgen"
 }
 
+# All company products in one alternation, in list order, so a single scan finds every candidate.
+# The lookahead makes matches zero-width: products starting inside another match are still seen.
+# Normalized once at import; the drug loop only ever sees names from this list.
+COMPANY_PRODUCT_NORMS: Dict[str, str] = {_prod: normalize_text(_prod) for _prod in company_products}
+COMPANY_PRODUCT_RANKS: Dict[str, Tuple[int, str]] = {}
+for _rank, _prod in enumerate(company_products):
+    if COMPANY_PRODUCT_NORMS[_prod]:
+        COMPANY_PRODUCT_RANKS.setdefault(COMPANY_PRODUCT_NORMS[_prod], (_rank, _prod))
+COMPANY_PRODUCT_RE = re.compile(
+    r'\b(?=(' + '|'.join(re.escape(pnorm) for pnorm in COMPANY_PRODUCT_RANKS) + r')\b)'
+)
+
+def contains_company_product(text: str) -> str:
+    """Return the earliest company_products entry found as a whole word in text, else ""."""
+    best = None
+    for m in COMPANY_PRODUCT_RE.finditer(normalize_text(text)):
+        hit = COMPANY_PRODUCT_RANKS[m.group(1)]
+        if best is None or hit < best:
+            best = hit
+    return best[1] if best else ""
+
 def parse_dd_mmm_yy(s):
     return datetime.strptime(s, "%d-%b-%y").date()
 
@@ -233,28 +351,761 @@ LAUNCH_INFO = {
     "amelgen": ("launched", None),
 }
 
+# Flat views of LAUNCH_INFO. The launch date is the earliest strength-specific one where the
+# strength is unknown, which is always the case for drugs taken from the XML.
+LAUNCH_STATUS: Dict[str, str] = {key: status for key, (status, _) in LAUNCH_INFO.items()}
+LAUNCH_DATE: Dict[str, date] = {}
+for _key, (_status, _payload) in LAUNCH_INFO.items():
+    if _status == "launched" and _payload:
+        LAUNCH_DATE[_key] = _payload
+    elif _status == "launched_by_strength" and _payload:
+        LAUNCH_DATE[_key] = min(_payload.values())
+
+@functools.lru_cache(maxsize=None)
 def get_launch_date(product_name: str, strength_mg) -> Optional[date]:
     key = normalize_text(product_name)
-    info = LAUNCH_INFO.get(key)
-    if not info:
-        return None
-    status, payload = info
-    if status == "launched":
-        return payload
-    if status == "launched_by_strength":
-        if isinstance(payload, dict) and payload:
-            if strength_mg is not None:
-                return payload.get(strength_mg) if strength_mg in payload else payload.get(float(strength_mg))  # type: ignore
-            return min(payload.values())
-        return None
-    return None
+    if strength_mg is not None and LAUNCH_STATUS.get(key) == "launched_by_strength":
+        payload = LAUNCH_INFO[key][1]
+        if not payload:
+            return None
+        return payload.get(strength_mg) if strength_mg in payload else payload.get(float(strength_mg))  # type: ignore
+    return LAUNCH_DATE.get(key)
 
+@functools.lru_cache(maxsize=None)
 def get_launch_status(product_name: str) -> Optional[str]:
-    key = normalize_text(product_name)
-    info = LAUNCH_INFO.get(key)
-    if not info:
+    return LAUNCH_STATUS.get(normalize_text(product_name))
+
+# HL7 v3 namespace-qualified tags, compared directly against Element.tag
+NS_HL7 = "{urn:hl7-org:v3}"
+TAG_LOW = NS_HL7 + "low"
+TAG_AVAILABILITY_TIME = NS_HL7 + "availabilityTime"
+TAG_CREATION_TIME = NS_HL7 + "creationTime"
+TAG_CODE = NS_HL7 + "code"
+TAG_VALUE = NS_HL7 + "value"
+TAG_HIGH = NS_HL7 + "high"
+TAG_EFFECTIVE_TIME = NS_HL7 + "effectiveTime"
+TAG_CAUSALITY_ASSESSMENT = NS_HL7 + "causalityAssessment"
+TAG_SUBSTANCE_ADMINISTRATION = NS_HL7 + "substanceAdministration"
+TAG_OBSERVATION = NS_HL7 + "observation"
+TAG_SUBJECT2 = NS_HL7 + "subject2"
+TAG_PRODUCT_USE_REFERENCE = NS_HL7 + "productUseReference"
+TAG_ID = NS_HL7 + "id"
+TAG_GIVEN = NS_HL7 + "given"
+TAG_FAMILY = NS_HL7 + "family"
+TAG_ORIGINAL_TEXT = NS_HL7 + "originalText"
+
+def hl7_path(path: str) -> str:
+    """Expand 'hl7:' prefixes into Clark notation so ElementPath needs no namespace map."""
+    return path.replace("hl7:", NS_HL7)
+
+# Case-level lookups, expanded once at import instead of resolving prefixes on every find()
+SENDER_OID = "2.16.840.1.113883.3.989.2.1.3.1"
+XP_REPORTER_CODE = hl7_path('.//hl7:asQualifiedEntity/hl7:code')
+XP_GENDER_CODE = hl7_path('.//hl7:administrativeGenderCode')
+XP_PATIENT_NAME = hl7_path('.//hl7:player1/hl7:name')
+XP_NARRATIVE = hl7_path('.//hl7:code[@code="PAT_ADV_EVNT"]/../hl7:text')
+
+# Relative to a substanceAdministration
+XP_DRUG_ID = hl7_path('.//hl7:id')
+XP_DRUG_KIND_NAME = hl7_path('.//hl7:kindOfProduct/hl7:name')
+XP_DRUG_MANUFACTURED_NAME = hl7_path('.//hl7:manufacturedProduct/hl7:name')
+XP_DRUG_TEXT = hl7_path('.//hl7:text')
+XP_DRUG_DOSE = hl7_path('.//hl7:doseQuantity')
+XP_DRUG_LOW = hl7_path('.//hl7:low')
+XP_DRUG_HIGH = hl7_path('.//hl7:high')
+XP_DRUG_FORM = hl7_path('.//hl7:formCode/hl7:originalText')
+XP_DRUG_LOT = hl7_path('.//hl7:lotNumberText')
+XP_DRUG_MAH_NAMES = tuple(hl7_path(p) for p in (
+    './/hl7:playingOrganization/hl7:name',
+    './/hl7:manufacturerOrganization/hl7:name',
+    './/hl7:asManufacturedProduct/hl7:manufacturerOrganization/hl7:name',
+))
+
+def scan_subtree(elem: ET.Element, display_names, tags=()) -> Tuple[Dict[str, ET.Element], Dict[str, ET.Element]]:
+    """One pass over elem's subtree, replacing a series of find() calls.
+
+    Returns (coded, first): coded maps each wanted code displayName to the <value> next to it,
+    i.e. find('.//hl7:code[@displayName="X"]/../hl7:value') for every X at once; first maps each
+    tag in `tags` to its first descendant with that tag, in document order.
+    """
+    coded: Dict[str, ET.Element] = {}
+    first: Dict[str, ET.Element] = {}
+    for parent in elem.iter():
+        if parent.tag in tags and parent is not elem:
+            first.setdefault(parent.tag, parent)
+        for child in parent:
+            if child.tag != TAG_CODE:
+                continue
+            dn = child.attrib.get('displayName')
+            if dn in display_names and dn not in coded:
+                value_elem = parent.find(TAG_VALUE)
+                if value_elem is not None:
+                    coded[dn] = value_elem
+    return coded, first
+
+# Elements the case assessment visits, grouped by one walk of the message (see index_elements).
+# Report-date lows and availabilityTimes share a bucket because FRD depends on their interleaving.
+E2B_INDEX_BUCKETS = {
+    TAG_ID: "id",
+    TAG_CREATION_TIME: "creation_time",
+    TAG_CAUSALITY_ASSESSMENT: "causality",
+    TAG_SUBSTANCE_ADMINISTRATION: "drug",
+    TAG_OBSERVATION: "observation",
+    TAG_LOW: "report_time",
+    TAG_AVAILABILITY_TIME: "report_time",
+}
+
+def index_elements(root: ET.Element, buckets: Dict[str, str]) -> Dict[str, List[ET.Element]]:
+    """Group root and its descendants by bucket name (keyed via their tag), in document order, in one walk."""
+    index: Dict[str, List[ET.Element]] = {name: [] for name in buckets.values()}
+    for elem in root.iter():
+        name = buckets.get(elem.tag)
+        if name is not None:
+            index[name].append(elem)
+    return index
+
+def causality_suspect_id(causality: ET.Element) -> Optional[str]:
+    """Product id a causalityAssessment marks as suspect (first <value> code '1'), else None.
+
+    The first <value> and the first subject2/productUseReference/id are picked up in one walk.
+    """
+    value_seen = False
+    suspect_id = None
+    for elem in causality.iter():
+        tag = elem.tag
+        if tag == TAG_VALUE and not value_seen and elem is not causality:
+            if elem.attrib.get('code') != '1':
+                return None
+            value_seen = True
+        elif tag == TAG_SUBJECT2 and suspect_id is None and elem is not causality:
+            for ref in elem:
+                if ref.tag == TAG_PRODUCT_USE_REFERENCE:
+                    id_elem = next((c for c in ref if c.tag == TAG_ID), None)
+                    if id_elem is not None:
+                        suspect_id = id_elem.attrib.get('root', '')
+                        break
+        if value_seen and suspect_id is not None:
+            return suspect_id
+    return suspect_id if value_seen else None
+
+def parse_e2b(source) -> ET.Element:
+    """Stream-parse an E2B XML file, dropping base64 attachment payloads as each element closes.
+
+    Attached source documents are usually the bulk of an E2B file and are never read by triage,
+    so only the structured part of the message stays in memory.
+    """
+    context = ET.iterparse(source, events=("end",))
+    for _, elem in context:
+        if elem.text and elem.attrib.get('representation') == 'B64':
+            elem.text = None
+    return context.root
+
+# Prefer xlsxwriter for the export (much faster than openpyxl for write-only workbooks).
+EXCEL_WRITER_ENGINE = "xlsxwriter" if importlib.util.find_spec("xlsxwriter") else "openpyxl"
+EXCEL_WRITER_KWARGS = {"options": {"strings_to_urls": False}} if EXCEL_WRITER_ENGINE == "xlsxwriter" else {}
+
+def upload_signature(*uploads) -> Tuple:
+    """Identity of the current uploads, used to reuse derived tables across reruns."""
+    sig = []
+    for up in uploads:
+        files = up if isinstance(up, list) else [up]
+        sig.append(tuple(getattr(f, "file_id", None) or getattr(f, "name", "") for f in files if f is not None))
+    return tuple(sig)
+
+# Output table column order (also the export order); CaseRow fields follow it position by position.
+OUTPUT_COLUMNS = [
+    'SL No', 'Date', 'Sender ID', 'Report Date', 'Case Age (days)', 'Reporter Qualification',
+    'Patient Detail', 'Product Detail', 'Event Details', 'Listedness', 'Narrative',
+    'Validity', 'Comment', 'Reportability', 'Parsing Warnings'
+]
+# Text columns are stored Arrow-backed (contiguous UTF-8) rather than as one Python object per cell.
+STRING_COLUMNS = [c for c in OUTPUT_COLUMNS if c not in ('SL No', 'Case Age (days)')]
+CaseRow = namedtuple("CaseRow", [
+    "sl_no", "date", "sender_id", "report_date", "case_age_days", "reporter_qualification",
+    "patient_detail", "product_detail", "event_details", "listedness", "narrative",
+    "validity", "comment", "reportability", "parsing_warnings"
+])
+
+SERIOUSNESS_MAP = {
+    "resultsInDeath": "Death",
+    "isLifeThreatening": "LT",
+    "requiresInpatientHospitalization": "Hospital",
+    "resultsInPersistentOrSignificantDisability": "Disability",
+    "congenitalAnomalyBirthDefect": "Congenital",
+    "otherMedicallyImportantCondition": "IME"
+}
+REACTION_CODED_NAMES = set(SERIOUSNESS_MAP) | {"outcome"}
+PATIENT_CODED_NAMES = frozenset({"age", "bodyWeight", "height", "ageGroup"})
+
+def build_case_row(
+    xml_bytes: bytes,
+    today: date,
+    mapping_loaded: bool,
+    llt_map: Dict[str, Tuple[str, str, str]],
+    llt_map_error: Optional[Exception],
+    listed_by_product: Dict[str, FrozenSet[str]],
+    competitor_names: FrozenSet[str],
+) -> CaseRow:
+    """Parse one E2B file and assess it into an output row.
+
+    'SL No' and 'Date' are left as None for the caller to fill in. Raises ET.ParseError
+    for malformed XML.
+    """
+    warnings: List[str] = []
+    # Ordered set of comments: repeats across drugs collapse on insert, and the Comment
+    # column lists them in the order the drugs were read.
+    comments: Dict[str, None] = {}
+    root = parse_e2b(io.BytesIO(xml_bytes))
+    # One walk shared by every whole-document scan below.
+    indexed = index_elements(root, E2B_INDEX_BUCKETS)
+
+    # Sender
+    sender_elem = next((e for e in indexed["id"] if e is not root and e.attrib.get('root') == SENDER_OID), None)
+    sender_id = clean_value(sender_elem.attrib.get('extension', '') if sender_elem is not None else '')
+
+    # TD fallback (for case age)
+    creation_elem = next((e for e in indexed["creation_time"] if e is not root), None)
+    creation_raw = creation_elem.attrib.get('value', '') if creation_elem is not None else ''
+    td_fallback = clean_value(format_date(creation_raw))
+
+    # Reporter Qualification
+    reporter_elem = root.find(XP_REPORTER_CODE)
+    reporter_qualification = clean_value(REPORTER_MAP.get(reporter_elem.attrib.get('code', '') if reporter_elem is not None else '', "Unknown"))
+
+    # Patient details
+    gender_elem = root.find(XP_GENDER_CODE)
+    gender_mapped = GENDER_MAP.get(gender_elem.attrib.get('code', '') if gender_elem is not None else '', "Unknown")
+    gender = clean_value(gender_mapped)
+
+    # Age, weight, height and age group values from one walk; each XPath '..' step
+    # rebuilt a parent map of the whole document.
+    patient_values, _ = scan_subtree(root, PATIENT_CODED_NAMES)
+    age_elem = patient_values.get("age")
+    age = ""
+    if age_elem is not None:
+        age_val = age_elem.attrib.get('value', '')
+        raw_unit = age_elem.attrib.get('unit', '')
+        unit_text = map_age_unit(raw_unit)
+        age_val = clean_value(age_val)
+        unit_text_disp = clean_value(unit_text)
+        if age_val:
+            try:
+                n = float(age_val)
+                if unit_text_disp in ("year", "month"):
+                    unit_text_disp = unit_text_disp + ("s" if n != 1 else "")
+            except Exception:
+                pass
+        age = f"{age_val}" + (f" {unit_text_disp}" if age_val and unit_text_disp else "") if age_val else ""
+
+    weight_elem = patient_values.get("bodyWeight")
+    weight_val = clean_value(weight_elem.attrib.get('value', '') if weight_elem is not None else '')
+    weight_unit = clean_value(weight_elem.attrib.get('unit', '') if weight_elem is not None else '')
+    weight = f"{weight_val}" + (f" {weight_unit}" if weight_val and weight_unit else "") if weight_val else ""
+
+    height_elem = patient_values.get("height")
+    height_val = clean_value(height_elem.attrib.get('value', '') if height_elem is not None else '')
+    height_unit = clean_value(height_elem.attrib.get('unit', '') if height_elem is not None else '')
+    height = f"{height_val}" + (f" {height_unit}" if height_val and height_unit else "") if height_val else ""
+
+    patient_initials = ""
+    name_elem = root.find(XP_PATIENT_NAME)
+    if name_elem is not None:
+        if 'nullFlavor' in name_elem.attrib and name_elem.attrib.get('nullFlavor') == 'MSK':
+            patient_initials = "Masked"
+        else:
+            init_parts = []
+            for g in name_elem.iterfind(TAG_GIVEN):
+                if g.text and g.text.strip():
+                    init_parts.append(g.text.strip()[0].upper())
+            fam = name_elem.find(TAG_FAMILY)
+            if fam is not None and fam.text and fam.text.strip():
+                init_parts.append(fam.text.strip()[0].upper())
+            if init_parts:
+                patient_initials = "".join(init_parts)
+            else:
+                if name_elem.text and name_elem.text.strip():
+                    patient_initials = name_elem.text.strip()
+    patient_initials = clean_value(patient_initials)
+
+    age_group_elem = patient_values.get("ageGroup")
+    age_group = ""
+    if age_group_elem is not None:
+        code_val = age_group_elem.attrib.get('code', '')
+        null_flavor = age_group_elem.attrib.get('nullFlavor', '')
+        if code_val in AGE_GROUP_MAP:
+            age_group = AGE_GROUP_MAP[code_val]
+        elif null_flavor in MASKED_FLAVORS or code_val in MASKED_FLAVORS:
+            age_group = "[Masked/Unknown]"
+    age_group = clean_value(age_group)
+
+    # Patient Record Number (OID)
+    patient_record_no = ''
+    oid = "2.16.840.1.113883.3.989.2.1.3.7"
+    for id_elem in indexed["id"]:
+        if id_elem.attrib.get('root') == oid:
+            nf = id_elem.attrib.get('nullFlavor', '')
+            ext = id_elem.attrib.get('extension', '')
+            if nf == 'MSK':
+                patient_record_no = 'Masked'
+            elif ext:
+                patient_record_no = ext.strip()
+            break
+
+    patient_parts = []
+    if patient_initials:
+        patient_parts.append(f"Initials: {patient_initials}")
+    if gender:
+        patient_parts.append(f"Gender: {gender}")
+    if age_group:
+        patient_parts.append(f"Age Group: {age_group}")
+    if age:
+        patient_parts.append(f"Age: {age}")
+    if height:
+        patient_parts.append(f"Height: {height}")
+    if weight:
+        patient_parts.append(f"Weight: {weight}")
+    if patient_record_no:
+        patient_parts.append(f"Record No: {patient_record_no}")
+    patient_detail = ", ".join(patient_parts)
+
+    has_any_patient_detail = any([patient_initials, gender, age_group, age, height, weight])
+
+    # Identify suspect products (value==1)
+    suspect_ids: FrozenSet[str] = frozenset(
+        suspect_id
+        for causality in indexed["causality"]
+        if (suspect_id := causality_suspect_id(causality)) is not None
+    )
+
+    product_details_buf = io.StringIO()
+    case_has_category2 = False
+    case_drug_dates_display: List[Tuple[str, Optional[float], Optional[date], Optional[date]]] = []
+    case_event_dates: List[Tuple[str, Optional[date], Optional[date]]] = []
+    case_displayed_mahs: List[str] = []
+    case_products_norm: Set[str] = set()
+    product_norm_to_pretty: Dict[str, str] = {}
+
+    displayed_drugs_assessment: List[Tuple[str, str]] = []
+
+    # Only suspect drugs are displayed or assessed; skip the walk when causality marked none.
+    drugs = indexed["drug"] if suspect_ids else ()
+    for drug in drugs:
+        id_elem = drug.find(XP_DRUG_ID)
+        drug_id = id_elem.attrib.get('root', '') if id_elem is not None else ''
+        if drug_id in suspect_ids:
+            name_elem_drug = drug.find(XP_DRUG_KIND_NAME)
+            raw_drug_text = ""
+            if name_elem_drug is not None:
+                if name_elem_drug.text and name_elem_drug.text.strip():
+                    raw_drug_text = name_elem_drug.text.strip()
+                else:
+                    orig = name_elem_drug.find(TAG_ORIGINAL_TEXT)
+                    if orig is not None and orig.text and orig.text.strip():
+                        raw_drug_text = orig.text.strip()
+                if not raw_drug_text and 'displayName' in name_elem_drug.attrib:
+                    raw_drug_text = name_elem_drug.attrib.get('displayName', '').strip()
+            if not raw_drug_text:
+                alt_name = drug.find(XP_DRUG_MANUFACTURED_NAME)
+                if alt_name is not None and alt_name.text and alt_name.text.strip():
+                    raw_drug_text = alt_name.text.strip()
+
+            matched_company_prod = contains_company_product(raw_drug_text)
+            if matched_company_prod:
+                norm_key = COMPANY_PRODUCT_NORMS[matched_company_prod]
+                case_products_norm.add(norm_key)
+                pretty_name = raw_drug_text if raw_drug_text else matched_company_prod.title()
+                product_norm_to_pretty.setdefault(norm_key, clean_value(pretty_name))
+                if norm_key in category2_products:
+                    case_has_category2 = True
+
+            text_elem = drug.find(XP_DRUG_TEXT)
+            dose_elem = drug.find(XP_DRUG_DOSE)
+            dose_val_raw = dose_elem.attrib.get('value', '') if dose_elem is not None else ''
+            dose_unit_raw = dose_elem.attrib.get('unit', '') if dose_elem is not None else ''
+            dose_val = clean_value(dose_val_raw)
+            dose_unit = clean_value(dose_unit_raw)
+
+            start_elem = drug.find(XP_DRUG_LOW)
+            stop_elem = drug.find(XP_DRUG_HIGH)
+            start_date_str = start_elem.attrib.get('value', '') if start_elem is not None else ''
+            stop_date_str = stop_elem.attrib.get('value', '') if stop_elem is not None else ''
+            start_date_disp = clean_value(format_date(start_date_str))
+            stop_date_disp = clean_value(format_date(stop_date_str))
+            start_date_obj = parse_date_obj(start_date_str)
+            stop_date_obj = parse_date_obj(stop_date_str)
+
+            mah_name_raw = ''
+            for path in XP_DRUG_MAH_NAMES:
+                node = drug.find(path)
+                if node is not None and node.text and node.text.strip():
+                    mah_name_raw = node.text.strip()
+                    break
+            mah_name_clean = clean_value(mah_name_raw)
+
+            if matched_company_prod:
+                parts = []
+                display_name_for_detail = raw_drug_text if raw_drug_text else matched_company_prod.title()
+                display_name_for_detail = clean_value(display_name_for_detail)
+                if display_name_for_detail:
+                    parts.append(f"Drug: {display_name_for_detail}")
+
+                text_clean = ""
+                if text_elem is not None and text_elem.text:
+                    text_clean = clean_value(text_elem.text)
+                if text_clean:
+                    parts.append(f"Dosage: {text_clean}")
+
+                if dose_val or dose_unit:
+                    if dose_val and dose_unit:
+                        parts.append(f"Dose: {dose_val} {dose_unit}")
+                    elif dose_val:
+                        parts.append(f"Dose: {dose_val}")
+                    elif dose_unit:
+                        parts.append(f"Dose Unit: {dose_unit}")
+
+                if start_date_disp:
+                    parts.append(f"Start Date: {start_date_disp}")
+                if stop_date_disp:
+                    parts.append(f"Stop Date: {stop_date_disp}")
+
+                form_elem = drug.find(XP_DRUG_FORM)
+                form_clean = ""
+                if form_elem is not None and form_elem.text:
+                    form_clean = clean_value(form_elem.text)
+                if form_clean:
+                    parts.append(f"Formulation: {form_clean}")
+
+                lot_elem = drug.find(XP_DRUG_LOT)
+                lot_clean = ""
+                if lot_elem is not None and lot_elem.text:
+                    lot_clean = clean_value(lot_elem.text)
+                if lot_clean:
+                    parts.append(f"Lot No: {lot_clean}")
+
+                if _ALNUM_RE.search(lot_clean):
+                    comments['Verify Lot No with Celix-Lot No List'] = None
+
+                if mah_name_clean:
+                    parts.append(f"MAH: {mah_name_clean}")
+                case_displayed_mahs.append(mah_name_clean)
+
+                for t in [display_name_for_detail, text_clean, form_clean, lot_clean]:
+                    for pl in extract_pl_numbers(t):
+                        comments[
+                            f"plz check product name as {display_name_for_detail} {pl} given"
+                            if display_name_for_detail else f"plz check product name: {pl} given"
+                        ] = None
+                if lot_clean and contains_competitor_name(lot_clean, competitor_names):
+                    comments[f"Lot number '{lot_clean}' may belong to another company — please verify."] = None
+                if mah_name_clean and MY_COMPANY_NAME.lower() not in mah_name_clean.lower():
+                    comments[f"MAH '{mah_name_clean}' differs from Celix — please verify."] = None
+
+                if parts:
+                    # Drugs and their fields share the "\n " separator in the Product Detail cell.
+                    if product_details_buf.tell():
+                        product_details_buf.write("\n ")
+                    product_details_buf.write("\n ".join(parts))
+
+                non_valid_reason = ""
+                if not has_any_patient_detail:
+                    non_valid_reason = "No patient details"
+                else:
+                    status = get_launch_status(matched_company_prod)
+                    if status in ("yet", "awaited"):
+                        non_valid_reason = "Product not Launched"
+                    else:
+                        launch_dt = get_launch_date(matched_company_prod, None)
+                        exposure_reasons = []
+                        # We'll use FRD/LRD computed later
+                        drug_prior = (start_date_obj and start_date_obj < (launch_dt or start_date_obj)) if launch_dt else False
+                        if launch_dt and drug_prior:
+                            exposure_reasons.append("Drug")
+                        if exposure_reasons:
+                            non_valid_reason = f"Drug exposure prior to Launch; {', '.join(sorted(set(exposure_reasons)))}"
+                displayed_drugs_assessment.append((display_name_for_detail or "Unknown product", non_valid_reason))
+
+                case_drug_dates_display.append((matched_company_prod, None, start_date_obj, stop_date_obj))
+
+    event_details_buf = io.StringIO()
+    event_llts_norm: List[str] = []
+    event_count = 1
+    case_has_serious_event = False
+
+    for reaction in indexed["observation"]:
+        code_elem = reaction.find(TAG_CODE)
+        if code_elem is not None and code_elem.attrib.get('displayName') == 'reaction':
+            value_elem = reaction.find(TAG_VALUE)
+            llt_code = value_elem.attrib.get('code', '') if value_elem is not None else ''
+            llt_term, pt_term = "", ""
+            llt_norm = None
+
+            if mapping_loaded and llt_code:
+                llt_code_str = llt_code.strip()
+                terms = llt_map.get(llt_code_str)
+                if llt_map_error is not None:
+                    warnings.append(f"LLT mapping failed for code {llt_code}: {llt_map_error}")
+                elif terms is not None:
+                    llt_term, pt_term, llt_norm = terms
+                else:
+                    warnings.append(f"LLT code {llt_code_str} not found in mapping file — LLT/PT terms unavailable for this event.")
+            elif llt_code:
+                warnings.append(f"LLT mapping file not provided — LLT/PT terms unavailable for code {llt_code}.")
+
+            if not llt_term and value_elem is not None:
+                llt_term = value_elem.attrib.get('displayName', '') or llt_term
+                llt_norm = None
+
+            if llt_norm is None:
+                llt_norm = normalize_text(llt_term)
+            event_llts_norm.append(llt_norm)
+
+            # Seriousness criteria, outcome and event dates all come from one walk of the reaction.
+            coded_values, first_elems = scan_subtree(reaction, REACTION_CODED_NAMES, (TAG_EFFECTIVE_TIME,))
+
+            seriousness_flags = []
+            for criterion, label in SERIOUSNESS_MAP.items():
+                criterion_elem = coded_values.get(criterion)
+                if criterion_elem is not None and criterion_elem.attrib.get('value') == 'true':
+                    seriousness_flags.append(label)
+            seriousness_display = "Non-serious" if not seriousness_flags else ", ".join(seriousness_flags)
+            if seriousness_flags:
+                case_has_serious_event = True
+
+            outcome_elem = coded_values.get("outcome")
+            outcome = OUTCOME_MAP.get(outcome_elem.attrib.get('code', '') if outcome_elem is not None else '', "Unknown")
+            outcome = clean_value(outcome)
+
+            evt_time = first_elems.get(TAG_EFFECTIVE_TIME)
+            evt_low = evt_time.find(TAG_LOW) if evt_time is not None else None
+            evt_high = evt_time.find(TAG_HIGH) if evt_time is not None else None
+            evt_low_str = evt_low.attrib.get('value', '') if evt_low is not None else ''
+            evt_high_str = evt_high.attrib.get('value', '') if evt_high is not None else ''
+            evt_low_disp = clean_value(format_date(evt_low_str))
+            evt_high_disp = clean_value(format_date(evt_high_str))
+            evt_low_obj = parse_date_obj(evt_low_str)
+            evt_high_obj = parse_date_obj(evt_high_str)
+            case_event_dates.append(("event", evt_low_obj, evt_high_obj))
+
+            # Written straight into the case buffer: one line per event, fields separated by "; ".
+            if event_count > 1:
+                event_details_buf.write("\n")
+            base = f"Event {event_count}: {llt_term} ({pt_term})" if pt_term else f"Event {event_count}: {llt_term}"
+            event_details_buf.write(base)
+            event_details_buf.write(f"; Seriousness: {seriousness_display}")
+            if outcome:
+                event_details_buf.write(f"; Outcome: {outcome}")
+            if evt_low_disp:
+                event_details_buf.write(f"; Event Start: {evt_low_disp}")
+            if evt_high_disp:
+                event_details_buf.write(f"; Event End: {evt_high_disp}")
+
+            event_count += 1
+
+    event_details_combined_display = event_details_buf.getvalue()
+
+    reportability = "Category 2, serious, reportable case" if (case_has_serious_event and case_has_category2) else "Non-Reportable"
+
+    global_dates = {
+        "FRD_raw": "",
+        "LRD_raw": "",
+        "TD_raw": "",
+        "FRD": "",
+        "LRD": "",
+        "TD": "",
+    }
+    try:
+        # TD
+        for el in indexed["creation_time"]:
+            val = el.attrib.get('value')
+            if val:
+                global_dates["TD_raw"] = val
+                global_dates["TD"] = format_date(val)
+                break
+        # FRD (last low), LRD (first availabilityTime)
+        last_low_value = None
+        for el in indexed["report_time"]:
+            tag = el.tag
+            if tag == TAG_LOW:
+                v = el.attrib.get('value')
+                if v:
+                    last_low_value = v
+            elif tag == TAG_AVAILABILITY_TIME:
+                v = el.attrib.get('value')
+                if v and not global_dates.get("LRD_raw"):
+                    global_dates["LRD_raw"] = v
+                    global_dates["LRD"] = format_date(v)
+                    break
+        if last_low_value:
+            global_dates["FRD_raw"] = last_low_value
+            global_dates["FRD"] = format_date(last_low_value)
+    except Exception:
+        pass
+
+    frd_disp = global_dates["FRD"]
+    lrd_disp = global_dates["LRD"]
+    td_disp = global_dates["TD"] or td_fallback
+
+    case_age_days = ""
+    if global_dates["TD_raw"]:
+        td_obj = parse_date_obj(global_dates["TD_raw"])
+        if td_obj:
+            case_age_days = (today - td_obj).days
+            if case_age_days < 0:
+                case_age_days = 0
+
+    validity_reason: Optional[str] = None
+    has_any_suspect = bool(suspect_ids)
+    has_celix_suspect = bool(case_products_norm)
+
+    if not has_any_patient_detail:
+        validity_reason = "No patient details"
+
+    if validity_reason is None and has_any_suspect and not has_celix_suspect:
+        validity_reason = "Non-company product"
+
+    if validity_reason is None and case_displayed_mahs:
+        if any(name and MY_COMPANY_NAME.lower() not in name.lower() for name in case_displayed_mahs):
+            validity_reason = "Non-company product"
+
+    # Launch status and earliest launch date in one pass; the date only matters while the case is still valid.
+    earliest_launch_dt = None
+    if validity_reason is None:
+        for prod, strength_mg, sdt, edt in case_drug_dates_display:
+            status = get_launch_status(prod)
+            if status in ("yet", "awaited"):
+                validity_reason = "Product not Launched"
+                break
+            if prod:
+                ld = get_launch_date(prod, strength_mg)
+                if ld and (earliest_launch_dt is None or ld < earliest_launch_dt):
+                    earliest_launch_dt = ld
+
+    frd_raw_obj = parse_date_obj(global_dates["FRD_raw"]) if global_dates["FRD_raw"] else None
+    lrd_raw_obj = parse_date_obj(global_dates["LRD_raw"]) if global_dates["LRD_raw"] else None
+    exposure_reasons = []
+    if validity_reason is None and earliest_launch_dt is not None:
+        launch_dt = earliest_launch_dt
+        if frd_raw_obj and frd_raw_obj < launch_dt:
+            exposure_reasons.append("FRD")
+        if lrd_raw_obj and lrd_raw_obj < launch_dt:
+            exposure_reasons.append("LRD")
+        earliest_event_dt = min((d for _, evt_start, evt_stop in case_event_dates for d in (evt_start, evt_stop) if d), default=None)
+        if earliest_event_dt and earliest_event_dt < launch_dt:
+            exposure_reasons.append("Event")
+        earliest_drug_dt = min((drug_start for prod, _, drug_start, _ in case_drug_dates_display if prod and drug_start), default=None)
+        if earliest_drug_dt and earliest_drug_dt < launch_dt:
+            exposure_reasons.append("Drug")
+        if exposure_reasons:
+            validity_reason = f"Drug exposure prior to Launch; {', '.join(sorted(set(exposure_reasons)))}"
+
+    validity_value = f"Non-Valid ({validity_reason})" if validity_reason else "Valid"
+
+    narrative_elem = root.find(XP_NARRATIVE)
+    narrative_full_raw = narrative_elem.text if narrative_elem is not None else ''
+    narrative_full = clean_value(narrative_full_raw)
+
+    if comments and validity_reason is None:
+        validity_value = "Kindly check comment and assess validity manually"
+
+    if isinstance(validity_value, str) and validity_value.startswith("Non-Valid"):
+        reportability = "NA"
+
+    is_non_valid_case = isinstance(validity_value, str) and validity_value.startswith("Non-Valid")
+
+    report_date_parts = []
+    if frd_disp:
+        report_date_parts.append(f"FRD: {frd_disp}")
+    if lrd_disp:
+        report_date_parts.append(f"LRD: {lrd_disp}")
+    if td_disp:
+        report_date_parts.append(f"TD: {td_disp}")
+    report_date_display = "\n".join(report_date_parts)
+
+    per_drug_nonvalid_lines = [f"{nm}: {rsn}" for nm, rsn in displayed_drugs_assessment if rsn]
+    show_per_drug_comment = (len(displayed_drugs_assessment) > 1) and (len(per_drug_nonvalid_lines) == len(displayed_drugs_assessment))
+    if show_per_drug_comment and isinstance(validity_value, str) and validity_value.startswith("Non-Valid"):
+        validity_value = f"{validity_value} \n Drug-wise: " + "; ".join(per_drug_nonvalid_lines)
+
+    # ---- LISTEDNESS (EVENT ONLY; PER-PRODUCT SUMMARY WHEN MULTI-PRODUCT) ----
+    event_wise_listedness_display = ""
+    if not is_non_valid_case and event_llts_norm:
+        if len(case_products_norm) <= 1:
+            listed_llts = EMPTY_LLTS.union(*(listed_by_product.get(pnorm, EMPTY_LLTS) for pnorm in case_products_norm))
+            if listed_llts:
+                lines = [
+                    f"Event {i}: {'Listed' if llt_norm in listed_llts else 'Unlisted'}"
+                    for i, llt_norm in enumerate(event_llts_norm, start=1)
+                ]
+            else:
+                # No Celix product, or none with reference entries: nothing can be listed.
+                lines = [f"Event {i}: Unlisted" for i in range(1, len(event_llts_norm) + 1)]
+            event_wise_listedness_display = "\n".join(lines)
+        else:
+            products_sorted = sorted(case_products_norm, key=lambda k: product_norm_to_pretty.get(k, k))
+            # Bit b of event_masks[i] is set when products_sorted[b] lists event i.
+            event_masks = [0] * len(event_llts_norm)
+            # Products with reference entries, via a C-level set intersection with the index keys.
+            referenced = case_products_norm & listed_by_product.keys()
+            for bit, pnorm in enumerate(products_sorted):
+                if pnorm not in referenced:
+                    continue
+                listed_llts = listed_by_product[pnorm]
+                for i, llt_norm in enumerate(event_llts_norm):
+                    if llt_norm in listed_llts:
+                        event_masks[i] |= 1 << bit
+            event_labels = [(f"Event {i}: Unlisted", f"Event {i}: Listed") for i in range(1, len(event_llts_norm) + 1)]
+            prod_lines: List[str] = []
+            for bit, pnorm in enumerate(products_sorted):
+                pretty = product_norm_to_pretty.get(pnorm, pnorm)
+                statuses = "; ".join(labels[(mask >> bit) & 1] for labels, mask in zip(event_labels, event_masks))
+                prod_lines.append(f"{pretty} - {statuses}")
+            event_wise_listedness_display = "\n".join(prod_lines)
+
+    return CaseRow(
+        sl_no=None,
+        date=None,
+        sender_id=sender_id,
+        report_date=report_date_display,
+        case_age_days=case_age_days,
+        reporter_qualification=reporter_qualification,
+        patient_detail=patient_detail,
+        product_detail=product_details_buf.getvalue(),
+        event_details=event_details_combined_display,
+        listedness=('' if is_non_valid_case else event_wise_listedness_display),
+        narrative=narrative_full,
+        validity=validity_value,
+        comment="; ".join(comments),
+        reportability=reportability,
+        parsing_warnings="; ".join(warnings) if warnings else ""
+    )
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def build_case_row_cached(
+    xml_bytes: bytes,
+    today: date,
+    mapping_key: Optional[str],
+    listedness_key: Optional[str],
+    competitor_names: FrozenSet[str],
+    _llt_map: Dict[str, Tuple[str, str, str]],
+    _llt_map_error: Optional[Exception],
+    _listed_by_product: Dict[str, FrozenSet[str]],
+) -> tuple:
+    """build_case_row memoized across reruns.
+
+    Keyed on the XML bytes, the day (case age) and content hashes of the reference files, which
+    stand in for the unhashed underscore arguments. Returns a plain tuple because cached values
+    are pickled; rebuild with CaseRow._make.
+    """
+    return tuple(build_case_row(
+        xml_bytes, today, mapping_key is not None,
+        _llt_map, _llt_map_error, _listed_by_product, competitor_names
+    ))
+
+def content_hash(uploaded_file) -> Optional[str]:
+    """Digest of an uploaded file's bytes, or None when nothing was uploaded."""
+    if uploaded_file is None:
         return None
-    return info[0]
+    return hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
 
 # -------------------------------- UI: Upload & Parse --------------------------
 
@@ -262,13 +1113,16 @@ tab1, tab2 = st.tabs(["Upload & Parse", "Export & Edit"])
 if "uploader_version" not in st.session_state:
     st.session_state["uploader_version"] = 0
 
-all_rows_display: List[Dict] = []
-current_date = datetime.now().strftime("%d-%b-%Y")
+all_rows_display: List[CaseRow] = []
+# One clock read per run so 'Date' and 'Case Age (days)' agree for every case in the batch.
+batch_now = datetime.now()
+batch_today = batch_now.date()
+current_date = batch_now.strftime("%d-%b-%Y")
 
 with tab1:
     st.markdown("### \U0001F50E Upload Files \U0001F5C2\ufe0f")
     if st.button("Clear Inputs", help="Clear uploaded XMLs and parsed data (keep access)."):
-        for k in ["df_display", "edited_df"]:
+        for k in ["df_display", "df_display_key", "edited_df"]:
             st.session_state.pop(k, None)
         st.session_state["uploader_version"] = st.session_state.get("uploader_version", 0) + 1
         st.rerun()
@@ -294,603 +1148,100 @@ with tab1:
         key=f"listedness_uploader_{ver}"
     )
 
-    competitor_names: Set[str] = set(DEFAULT_COMPETITOR_NAMES)
+    inputs_signature = (ver,) + upload_signature(uploaded_files, mapping_file, listedness_file)
 
-    mapping_df = None
+    competitor_names: FrozenSet[str] = frozenset(DEFAULT_COMPETITOR_NAMES)
+
+    llt_map: Dict[str, Tuple[str, str, str]] = {}
+    llt_map_error: Optional[Exception] = None
     if mapping_file:
-        mapping_df = pd.read_excel(mapping_file, engine="openpyxl")
-        if "LLT Code" in mapping_df.columns:
-            mapping_df["LLT Code"] = mapping_df["LLT Code"].astype(str).str.strip()
+        llt_map, llt_map_error = load_llt_map(mapping_file.getvalue())
 
-    listedness_pairs: Set[Tuple[str, str]] = set()
+    listed_by_product: Dict[str, FrozenSet[str]] = {}
     if listedness_file:
         try:
-            ldf = pd.read_excel(listedness_file, engine="openpyxl")
-            listedness_pairs = to_pair_set(ldf)
-            if not listedness_pairs:
+            listed_by_product = load_listed_by_product(listedness_file.getvalue())
+            if not listed_by_product:
                 st.info("Listedness file loaded but produced no valid pairs. Check column names and values.")
         except Exception as e:
             st.error(f"Failed to read Listedness file: {e}")
 
-    seriousness_map = {
-        "resultsInDeath": "Death",
-        "isLifeThreatening": "LT",
-        "requiresInpatientHospitalization": "Hospital",
-        "resultsInPersistentOrSignificantDisability": "Disability",
-        "congenitalAnomalyBirthDefect": "Congenital",
-        "otherMedicallyImportantCondition": "IME"
-    }
+    mapping_key = content_hash(mapping_file)
+    listedness_key = content_hash(listedness_file)
 
     if uploaded_files:
         st.markdown("### \u23f3 Parsing Files...")
         progress = st.progress(0)
         total_files = len(uploaded_files)
         parsed_rows = 0
+        # Each progress update is a round trip to the browser; cap them at about 50 per batch.
+        progress_step = max(1, total_files // 50)
 
         for idx, uploaded_file in enumerate(uploaded_files, start=1):
-            warnings: List[str] = []
-            comments: List[str] = []
             try:
-                tree = ET.parse(uploaded_file)
-                root = tree.getroot()
+                row = CaseRow._make(build_case_row_cached(
+                    uploaded_file.getvalue(), batch_today, mapping_key, listedness_key,
+                    competitor_names, llt_map, llt_map_error, listed_by_product
+                ))
             except Exception as e:
                 st.error(f"Failed to parse XML file {getattr(uploaded_file, 'name', '(unnamed)')}: {e}")
-                progress.progress(idx / total_files)
-                continue
-
-            ns = {'hl7': 'urn:hl7-org:v3', 'xsi': 'http://www.w3.org/2001/XMLSchema-instance'}
-
-            # Sender
-            sender_elem = root.find('.//hl7:id[@root="2.16.840.1.113883.3.989.2.1.3.1"]', ns)
-            sender_id = clean_value(sender_elem.attrib.get('extension', '') if sender_elem is not None else '')
-
-            # TD fallback (for case age)
-            creation_elem = root.find('.//hl7:creationTime', ns)
-            creation_raw = creation_elem.attrib.get('value', '') if creation_elem is not None else ''
-            td_fallback = clean_value(format_date(creation_raw))
-
-            # Reporter Qualification
-            reporter_elem = root.find('.//hl7:asQualifiedEntity/hl7:code', ns)
-            reporter_qualification = clean_value(map_reporter(reporter_elem.attrib.get('code', '') if reporter_elem is not None else ''))
-
-            # Patient details
-            gender_elem = root.find('.//hl7:administrativeGenderCode', ns)
-            gender_mapped = map_gender(gender_elem.attrib.get('code', '') if gender_elem is not None else '')
-            gender = clean_value(gender_mapped)
-
-            age_elem = root.find('.//hl7:code[@displayName="age"]/../hl7:value', ns)
-            age = ""
-            if age_elem is not None:
-                age_val = age_elem.attrib.get('value', '')
-                raw_unit = age_elem.attrib.get('unit', '')
-                unit_text = map_age_unit(raw_unit)
-                age_val = clean_value(age_val)
-                unit_text_disp = clean_value(unit_text)
-                if age_val:
-                    try:
-                        n = float(age_val)
-                        if unit_text_disp in ("year", "month"):
-                            unit_text_disp = unit_text_disp + ("s" if n != 1 else "")
-                    except Exception:
-                        pass
-                age = f"{age_val}" + (f" {unit_text_disp}" if age_val and unit_text_disp else "") if age_val else ""
-
-            weight_elem = root.find('.//hl7:code[@displayName="bodyWeight"]/../hl7:value', ns)
-            weight_val = clean_value(weight_elem.attrib.get('value', '') if weight_elem is not None else '')
-            weight_unit = clean_value(weight_elem.attrib.get('unit', '') if weight_elem is not None else '')
-            weight = f"{weight_val}" + (f" {weight_unit}" if weight_val and weight_unit else "") if weight_val else ""
-
-            height_elem = root.find('.//hl7:code[@displayName="height"]/../hl7:value', ns)
-            height_val = clean_value(height_elem.attrib.get('value', '') if height_elem is not None else '')
-            height_unit = clean_value(height_elem.attrib.get('unit', '') if height_elem is not None else '')
-            height = f"{height_val}" + (f" {height_unit}" if height_val and height_unit else "") if height_val else ""
-
-            patient_initials = ""
-            name_elem = root.find('.//hl7:player1/hl7:name', ns)
-            if name_elem is not None:
-                if 'nullFlavor' in name_elem.attrib and name_elem.attrib.get('nullFlavor') == 'MSK':
-                    patient_initials = "Masked"
-                else:
-                    init_parts = []
-                    for g in name_elem.findall('hl7:given', ns):
-                        if g.text and g.text.strip():
-                            init_parts.append(g.text.strip()[0].upper())
-                    fam = name_elem.find('hl7:family', ns)
-                    if fam is not None and fam.text and fam.text.strip():
-                        init_parts.append(fam.text.strip()[0].upper())
-                    if init_parts:
-                        patient_initials = "".join(init_parts)
-                    else:
-                        if name_elem.text and name_elem.text.strip():
-                            patient_initials = name_elem.text.strip()
-            patient_initials = clean_value(patient_initials)
-
-            age_group_map = {"0": "Foetus", "1": "Neonate", "2": "Infant", "3": "Child", "4": "Adolescent", "5": "Adult", "6": "Elderly"}
-            age_group_elem = root.find('.//hl7:code[@displayName="ageGroup"]/../hl7:value', ns)
-            age_group = ""
-            if age_group_elem is not None:
-                code_val = age_group_elem.attrib.get('code', '')
-                null_flavor = age_group_elem.attrib.get('nullFlavor', '')
-                if code_val in age_group_map:
-                    age_group = age_group_map[code_val]
-                elif null_flavor in ["MSK", "UNK", "ASKU", "NI"] or code_val in ["MSK", "UNK", "ASKU", "NI"]:
-                    age_group = "[Masked/Unknown]"
-            age_group = clean_value(age_group)
-
-            # Patient Record Number (OID)
-            patient_record_no = ''
-            oid = "2.16.840.1.113883.3.989.2.1.3.7"
-            for id_elem in root.findall('.//hl7:id', ns):
-                if id_elem.attrib.get('root') == oid:
-                    nf = id_elem.attrib.get('nullFlavor', '')
-                    ext = id_elem.attrib.get('extension', '')
-                    if nf == 'MSK':
-                        patient_record_no = 'Masked'
-                    elif ext:
-                        patient_record_no = ext.strip()
-                    break
-
-            patient_parts = []
-            if patient_initials:
-                patient_parts.append(f"Initials: {patient_initials}")
-            if gender:
-                patient_parts.append(f"Gender: {gender}")
-            if age_group:
-                patient_parts.append(f"Age Group: {age_group}")
-            if age:
-                patient_parts.append(f"Age: {age}")
-            if height:
-                patient_parts.append(f"Height: {height}")
-            if weight:
-                patient_parts.append(f"Weight: {weight}")
-            if patient_record_no:
-                patient_parts.append(f"Record No: {patient_record_no}")
-            patient_detail = ", ".join(patient_parts)
-
-            has_any_patient_detail = any([patient_initials, gender, age_group, age, height, weight])
-
-            # Identify suspect products (value==1)
-            suspect_ids: List[str] = []
-            for causality in root.findall('.//hl7:causalityAssessment', ns):
-                val_elem = causality.find('.//hl7:value', ns)
-                if val_elem is not None and val_elem.attrib.get('code') == '1':
-                    subj_id_elem = causality.find('.//hl7:subject2/hl7:productUseReference/hl7:id', ns)
-                    if subj_id_elem is not None:
-                        suspect_ids.append(subj_id_elem.attrib.get('root', ''))
-
-            product_details_list: List[str] = []
-            case_has_category2 = False
-            case_drug_dates_display: List[Tuple[str, Optional[float], Optional[date], Optional[date]]] = []
-            case_event_dates: List[Tuple[str, Optional[date], Optional[date]]] = []
-            case_displayed_mahs: List[str] = []
-            case_products_norm: Set[str] = set()
-            product_norm_to_pretty: Dict[str, str] = {}
-
-            displayed_drugs_assessment: List[Tuple[str, str]] = []
-
-            for drug in root.findall('.//hl7:substanceAdministration', ns):
-                id_elem = drug.find('.//hl7:id', ns)
-                drug_id = id_elem.attrib.get('root', '') if id_elem is not None else ''
-                if drug_id in suspect_ids:
-                    name_elem_drug = drug.find('.//hl7:kindOfProduct/hl7:name', ns)
-                    raw_drug_text = ""
-                    if name_elem_drug is not None:
-                        if name_elem_drug.text and name_elem_drug.text.strip():
-                            raw_drug_text = name_elem_drug.text.strip()
-                        else:
-                            orig = name_elem_drug.find('hl7:originalText', ns)
-                            if orig is not None and orig.text and orig.text.strip():
-                                raw_drug_text = orig.text.strip()
-                        if not raw_drug_text and 'displayName' in name_elem_drug.attrib:
-                            raw_drug_text = name_elem_drug.attrib.get('displayName', '').strip()
-                    if not raw_drug_text:
-                        alt_name = drug.find('.//hl7:manufacturedProduct/hl7:name', ns)
-                        if alt_name is not None and alt_name.text and alt_name.text.strip():
-                            raw_drug_text = alt_name.text.strip()
-
-                    def contains_company_product(text: str, company_products: list) -> str:
-                        norm = normalize_text(text)
-                        for prod in company_products:
-                            pnorm = normalize_text(prod)
-                            if not pnorm:
-                                continue
-                            pattern = r'\b' + re.escape(pnorm) + r'\b'
-                            if re.search(pattern, norm):
-                                return prod
-                        return ""
-
-                    matched_company_prod = contains_company_product(raw_drug_text, company_products)
-                    if matched_company_prod:
-                        norm_key = normalize_text(matched_company_prod)
-                        case_products_norm.add(norm_key)
-                        pretty_name = raw_drug_text if raw_drug_text else matched_company_prod.title()
-                        product_norm_to_pretty.setdefault(norm_key, clean_value(pretty_name))
-                        if norm_key in category2_products:
-                            case_has_category2 = True
-
-                    text_elem = drug.find('.//hl7:text', ns)
-                    dose_elem = drug.find('.//hl7:doseQuantity', ns)
-                    dose_val_raw = dose_elem.attrib.get('value', '') if dose_elem is not None else ''
-                    dose_unit_raw = dose_elem.attrib.get('unit', '') if dose_elem is not None else ''
-                    dose_val = clean_value(dose_val_raw)
-                    dose_unit = clean_value(dose_unit_raw)
-
-                    start_elem = drug.find('.//hl7:low', ns)
-                    stop_elem = drug.find('.//hl7:high', ns)
-                    start_date_str = start_elem.attrib.get('value', '') if start_elem is not None else ''
-                    stop_date_str = stop_elem.attrib.get('value', '') if stop_elem is not None else ''
-                    start_date_disp = clean_value(format_date(start_date_str))
-                    stop_date_disp = clean_value(format_date(stop_date_str))
-                    start_date_obj = parse_date_obj(start_date_str)
-                    stop_date_obj = parse_date_obj(stop_date_str)
-
-                    mah_name_raw = ''
-                    for path in [
-                        './/hl7:playingOrganization/hl7:name',
-                        './/hl7:manufacturerOrganization/hl7:name',
-                        './/hl7:asManufacturedProduct/hl7:manufacturerOrganization/hl7:name',
-                    ]:
-                        node = drug.find(path, ns)
-                        if node is not None and node.text and node.text.strip():
-                            mah_name_raw = node.text.strip()
-                            break
-                    mah_name_clean = clean_value(mah_name_raw)
-
-                    if matched_company_prod:
-                        parts = []
-                        display_name_for_detail = raw_drug_text if raw_drug_text else matched_company_prod.title()
-                        display_name_for_detail = clean_value(display_name_for_detail)
-                        if display_name_for_detail:
-                            parts.append(f"Drug: {display_name_for_detail}")
-
-                        text_clean = ""
-                        if text_elem is not None and text_elem.text:
-                            text_clean = clean_value(text_elem.text)
-                        if text_clean:
-                            parts.append(f"Dosage: {text_clean}")
-
-                        if dose_val or dose_unit:
-                            if dose_val and dose_unit:
-                                parts.append(f"Dose: {dose_val} {dose_unit}")
-                            elif dose_val:
-                                parts.append(f"Dose: {dose_val}")
-                            elif dose_unit:
-                                parts.append(f"Dose Unit: {dose_unit}")
-
-                        if start_date_disp:
-                            parts.append(f"Start Date: {start_date_disp}")
-                        if stop_date_disp:
-                            parts.append(f"Stop Date: {stop_date_disp}")
-
-                        form_elem = drug.find('.//hl7:formCode/hl7:originalText', ns)
-                        form_clean = ""
-                        if form_elem is not None and form_elem.text:
-                            form_clean = clean_value(form_elem.text)
-                        if form_clean:
-                            parts.append(f"Formulation: {form_clean}")
-
-                        lot_elem = drug.find('.//hl7:lotNumberText', ns)
-                        lot_clean = ""
-                        if lot_elem is not None and lot_elem.text:
-                            lot_clean = clean_value(lot_elem.text)
-                        if lot_clean:
-                            parts.append(f"Lot No: {lot_clean}")
-
-                        if re.search(r'[A-Za-z0-9]', lot_clean):
-                            comments.append('Verify Lot No with Celix-Lot No List')
-
-                        if mah_name_clean:
-                            parts.append(f"MAH: {mah_name_clean}")
-                        case_displayed_mahs.append(mah_name_clean)
-
-                        for t in [display_name_for_detail, text_clean, form_clean, lot_clean]:
-                            for pl in extract_pl_numbers(t):
-                                comments.append(
-                                    f"plz check product name as {display_name_for_detail} {pl} given"
-                                    if display_name_for_detail else f"plz check product name: {pl} given"
-                                )
-                        if lot_clean and contains_competitor_name(lot_clean, competitor_names):
-                            comments.append(f"Lot number '{lot_clean}' may belong to another company — please verify.")
-                        if mah_name_clean and MY_COMPANY_NAME.lower() not in mah_name_clean.lower():
-                            comments.append(f"MAH '{mah_name_clean}' differs from Celix — please verify.")
-
-                        if parts:
-                            product_details_list.append("\n ".join(parts))
-
-                        non_valid_reason = ""
-                        if not has_any_patient_detail:
-                            non_valid_reason = "No patient details"
-                        else:
-                            status = get_launch_status(matched_company_prod)
-                            if status in ("yet", "awaited"):
-                                non_valid_reason = "Product not Launched"
-                            else:
-                                launch_dt = get_launch_date(matched_company_prod, None)
-                                exposure_reasons = []
-                                # We'll use FRD/LRD computed later
-                                drug_prior = (start_date_obj and start_date_obj < (launch_dt or start_date_obj)) if launch_dt else False
-                                if launch_dt and drug_prior:
-                                    exposure_reasons.append("Drug")
-                                if exposure_reasons:
-                                    non_valid_reason = f"Drug exposure prior to Launch; {', '.join(sorted(set(exposure_reasons)))}"
-                        displayed_drugs_assessment.append((display_name_for_detail or "Unknown product", non_valid_reason))
-
-                        case_drug_dates_display.append((matched_company_prod, None, start_date_obj, None))
-
-            seriousness_criteria = list(seriousness_map.keys())
-            event_details_list: List[str] = []
-            event_llts_norm: List[str] = []
-            event_count = 1
-            case_has_serious_event = False
-
-            for reaction in root.findall('.//hl7:observation', ns):
-                code_elem = reaction.find('hl7:code', ns)
-                if code_elem is not None and code_elem.attrib.get('displayName') == 'reaction':
-                    value_elem = reaction.find('hl7:value', ns)
-                    llt_code = value_elem.attrib.get('code', '') if value_elem is not None else ''
-                    llt_term, pt_term = "", ""
-
-                    if mapping_df is not None and llt_code:
-                        try:
-                            llt_code_str = str(llt_code).strip()
-                            row = mapping_df[mapping_df['LLT Code'] == llt_code_str]
-                            if not row.empty:
-                                llt_term = str(row['LLT Term'].values[0])
-                                pt_term = str(row['PT Term'].values[0])
-                            else:
-                                warnings.append(f"LLT code {llt_code_str} not found in mapping file — LLT/PT terms unavailable for this event.")
-                        except Exception as e:
-                            warnings.append(f"LLT mapping failed for code {llt_code}: {e}")
-                    elif llt_code:
-                        warnings.append(f"LLT mapping file not provided — LLT/PT terms unavailable for code {llt_code}.")
-
-                    if not llt_term and value_elem is not None:
-                        llt_term = value_elem.attrib.get('displayName', '') or llt_term
-
-                    llt_norm = normalize_text(llt_term)
-                    event_llts_norm.append(llt_norm)
-
-                    seriousness_flags = []
-                    for criterion in seriousness_criteria:
-                        criterion_elem = reaction.find(f'.//hl7:code[@displayName="{criterion}"]/../hl7:value', ns)
-                        if criterion_elem is not None and criterion_elem.attrib.get('value') == 'true':
-                            seriousness_flags.append(seriousness_map.get(criterion, criterion))
-                    seriousness_display = "Non-serious" if not seriousness_flags else ", ".join(seriousness_flags)
-                    if seriousness_flags:
-                        case_has_serious_event = True
-
-                    outcome_elem = reaction.find('.//hl7:code[@displayName="outcome"]/../hl7:value', ns)
-                    outcome = map_outcome(outcome_elem.attrib.get('code', '') if outcome_elem is not None else '')
-                    outcome = clean_value(outcome)
-
-                    evt_low = reaction.find('.//hl7:effectiveTime/hl7:low', ns)
-                    evt_high = reaction.find('.//hl7:effectiveTime/hl7:high', ns)
-                    evt_low_str = evt_low.attrib.get('value', '') if evt_low is not None else ''
-                    evt_high_str = evt_high.attrib.get('value', '') if evt_high is not None else ''
-                    evt_low_disp = clean_value(format_date(evt_low_str))
-                    evt_high_disp = clean_value(format_date(evt_high_str))
-                    evt_low_obj = parse_date_obj(evt_low_str)
-                    evt_high_obj = parse_date_obj(evt_high_str)
-                    case_event_dates.append(("event", evt_low_obj, evt_high_obj))
-
-                    base = f"Event {event_count}: {llt_term} ({pt_term})" if pt_term else f"Event {event_count}: {llt_term}"
-                    details_parts = [base, f"Seriousness: {seriousness_display}"]
-                    if outcome:
-                        details_parts.append(f"Outcome: {outcome}")
-                    if evt_low_disp:
-                        details_parts.append(f"Event Start: {evt_low_disp}")
-                    if evt_high_disp:
-                        details_parts.append(f"Event End: {evt_high_disp}")
-                    event_details_list.append("; ".join(details_parts))
-
-                    event_count += 1
-
-            event_details_combined_display = "\n".join(event_details_list)
-
-            reportability = "Category 2, serious, reportable case" if (case_has_serious_event and case_has_category2) else "Non-Reportable"
-
-            global_dates = {
-                "FRD_raw": "",
-                "LRD_raw": "",
-                "TD_raw": "",
-                "FRD": "",
-                "LRD": "",
-                "TD": "",
-            }
-            try:
-                # TD
-                for el in root.iter():
-                    if el.tag.endswith('creationTime'):
-                        val = el.attrib.get('value')
-                        if val:
-                            global_dates["TD_raw"] = val
-                            global_dates["TD"] = format_date(val)
-                            break
-                # FRD (last low), LRD (first availabilityTime)
-                last_low_value = None
-                for el in root.iter():
-                    ln = el.tag.split('}')[-1] if '}' in el.tag else el.tag
-                    if ln == 'low':
-                        v = el.attrib.get('value')
-                        if v:
-                            last_low_value = v
-                    elif ln == 'availabilityTime':
-                        v = el.attrib.get('value')
-                        if v and not global_dates.get("LRD_raw"):
-                            global_dates["LRD_raw"] = v
-                            global_dates["LRD"] = format_date(v)
-                            break
-                if last_low_value:
-                    global_dates["FRD_raw"] = last_low_value
-                    global_dates["FRD"] = format_date(last_low_value)
-            except Exception:
-                pass
+            else:
+                all_rows_display.append(row._replace(sl_no=idx, date=current_date))
+                parsed_rows += 1
 
-            frd_disp = global_dates["FRD"]
-            lrd_disp = global_dates["LRD"]
-            td_disp = global_dates["TD"] or td_fallback
-
-            case_age_days = ""
-            if global_dates["TD_raw"]:
-                td_obj = parse_date_obj(global_dates["TD_raw"])
-                if td_obj:
-                    case_age_days = (datetime.now().date() - td_obj).days
-                    if case_age_days < 0:
-                        case_age_days = 0
-
-            validity_reason: Optional[str] = None
-            has_any_suspect = bool(suspect_ids)
-            has_celix_suspect = bool(case_products_norm)
-
-            if not has_any_patient_detail:
-                validity_reason = "No patient details"
-
-            if validity_reason is None and has_any_suspect and not has_celix_suspect:
-                validity_reason = "Non-company product"
+            if idx % progress_step == 0 or idx == total_files:
+                progress.progress(idx / total_files)
 
-            if validity_reason is None and case_displayed_mahs:
-                if any(name and MY_COMPANY_NAME.lower() not in name.lower() for name in case_displayed_mahs):
-                    validity_reason = "Non-company product"
+        st.success(f"Parsing complete \u2705 — Files processed: {total_files}, Rows created: {parsed_rows}")
 
-            if validity_reason is None:
-                for prod, strength_mg, sdt, edt in case_drug_dates_display:
-                    status = get_launch_status(prod)
-                    if status in ("yet", "awaited"):
-                        validity_reason = "Product not Launched"
-                        break
+# -------------------------------- UI: Export & Edit ---------------------------
+@st.fragment
+def render_parsed_table(df_full: pd.DataFrame) -> None:
+    """Table view and Excel export. Runs as a fragment, so toggling the narrative view or
+    editing cells reruns only this part instead of the whole upload-and-parse script."""
+    show_full_narrative = st.checkbox("Show full narrative (may be long)", value=True)
+    df_display = df_full
+    if not show_full_narrative:
+        df_display = df_full.assign(Narrative=df_full['Narrative'].str.slice(0, 1000))
+
+    edited_df = st.data_editor(
+        df_display,
+        num_rows="dynamic",
+        use_container_width=True,
+        disabled=df_display.columns
+    )
 
-            earliest_launch_dt = None
-            for prod, strength_mg, sdt, edt in case_drug_dates_display:
-                if prod:
-                    ld = get_launch_date(prod, strength_mg)
-                    if ld:
-                        earliest_launch_dt = ld if (earliest_launch_dt is None or ld < earliest_launch_dt) else earliest_launch_dt
-
-            frd_raw_obj = parse_date_obj(global_dates["FRD_raw"]) if global_dates["FRD_raw"] else None
-            lrd_raw_obj = parse_date_obj(global_dates["LRD_raw"]) if global_dates["LRD_raw"] else None
-            exposure_reasons = []
-            if validity_reason is None and earliest_launch_dt is not None:
-                if frd_raw_obj and frd_raw_obj < earliest_launch_dt:
-                    exposure_reasons.append("FRD")
-                if lrd_raw_obj and lrd_raw_obj < earliest_launch_dt:
-                    exposure_reasons.append("LRD")
-                event_prior = any(
-                    (evt_start and evt_start < earliest_launch_dt) or
-                    (evt_stop and evt_stop < earliest_launch_dt)
-                    for _, evt_start, evt_stop in case_event_dates
-                )
-                if event_prior:
-                    exposure_reasons.append("Event")
-                drug_prior = any(
-                    (drug_start and drug_start < earliest_launch_dt)
-                    for prod, _, drug_start, _ in case_drug_dates_display
-                    if prod
-                )
-                if drug_prior:
-                    exposure_reasons.append("Drug")
-                if exposure_reasons:
-                    validity_reason = f"Drug exposure prior to Launch; {', '.join(sorted(set(exposure_reasons)))}"
-
-            validity_value = f"Non-Valid ({validity_reason})" if validity_reason else "Valid"
-
-            narrative_elem = root.find('.//hl7:code[@code="PAT_ADV_EVNT"]/../hl7:text', ns)
-            narrative_full_raw = narrative_elem.text if narrative_elem is not None else ''
-            narrative_full = clean_value(narrative_full_raw)
-
-            if comments and validity_reason is None:
-                validity_value = "Kindly check comment and assess validity manually"
-
-            if isinstance(validity_value, str) and validity_value.startswith("Non-Valid"):
-                reportability = "NA"
-
-            is_non_valid_case = isinstance(validity_value, str) and validity_value.startswith("Non-Valid")
-
-            report_date_parts = []
-            if frd_disp:
-                report_date_parts.append(f"FRD: {frd_disp}")
-            if lrd_disp:
-                report_date_parts.append(f"LRD: {lrd_disp}")
-            if td_disp:
-                report_date_parts.append(f"TD: {td_disp}")
-            report_date_display = "\n".join(report_date_parts)
-
-            per_drug_nonvalid_lines = [f"{nm}: {rsn}" for nm, rsn in displayed_drugs_assessment if rsn]
-            show_per_drug_comment = (len(displayed_drugs_assessment) > 1) and (len(per_drug_nonvalid_lines) == len(displayed_drugs_assessment))
-            if show_per_drug_comment and isinstance(validity_value, str) and validity_value.startswith("Non-Valid"):
-                validity_value = f"{validity_value} \n Drug-wise: " + "; ".join(per_drug_nonvalid_lines)
-
-            # ---- LISTEDNESS (EVENT ONLY; PER-PRODUCT SUMMARY WHEN MULTI-PRODUCT) ----
-            event_wise_listedness_display = ""
-            if not is_non_valid_case and event_llts_norm:
-                if len(case_products_norm) <= 1:
-                    lines = []
-                    products_to_check = list(case_products_norm) if case_products_norm else []
-                    for i, llt_norm in enumerate(event_llts_norm, start=1):
-                        is_listed = any((pnorm, llt_norm) in listedness_pairs for pnorm in products_to_check)
-                        lines.append(f"Event {i}: {'Listed' if is_listed else 'Unlisted'}")
-                    event_wise_listedness_display = "\n".join(lines)
-                else:
-                    prod_lines: List[str] = []
-                    for pnorm in sorted(list(case_products_norm), key=lambda k: product_norm_to_pretty.get(k, k)):
-                        pretty = product_norm_to_pretty.get(pnorm, pnorm)
-                        statuses = []
-                        for i, llt_norm in enumerate(event_llts_norm, start=1):
-                            is_listed = (pnorm, llt_norm) in listedness_pairs
-                            statuses.append(f"Event {i}: {'Listed' if is_listed else 'Unlisted'}")
-                        prod_lines.append(f"{pretty} - " + "; ".join(statuses))
-                    event_wise_listedness_display = "\n".join(prod_lines)
-
-            all_rows_display.append({
-                'SL No': idx,
-                'Date': current_date,
-                'Sender ID': sender_id,
-                'Report Date': report_date_display,
-                'Case Age (days)': case_age_days,
-                'Reporter Qualification': reporter_qualification,
-                'Patient Detail': patient_detail,
-                'Product Detail': "\n ".join(product_details_list),
-                'Event Details': event_details_combined_display,
-                'Listedness': ('' if is_non_valid_case else event_wise_listedness_display),
-                'Narrative': narrative_full,
-                'Validity': validity_value,
-                'Comment': "; ".join(sorted(set(comments))) if comments else "",
-                'Reportability': reportability,
-                'Parsing Warnings': "; ".join(warnings) if warnings else ""
-            })
+    def build_excel() -> bytes:
+        excel_buffer = io.BytesIO()
+        with pd.ExcelWriter(excel_buffer, engine=EXCEL_WRITER_ENGINE, engine_kwargs=EXCEL_WRITER_KWARGS) as writer:
+            edited_df.to_excel(writer, index=False, sheet_name="Parsed Data")
+        return excel_buffer.getvalue()
 
-            parsed_rows += 1
-            progress.progress(idx / total_files)
+    def build_csv() -> bytes:
+        # BOM so Excel opens the UTF-8 text (em dashes, accented names) correctly.
+        return edited_df.to_csv(index=False).encode("utf-8-sig")
 
-        st.success(f"Parsing complete \u2705 — Files processed: {total_files}, Rows created: {parsed_rows}")
+    # Passed as callables, so the files are only written when a button is clicked.
+    st.download_button("\u2B07\uFE0F Download Excel", build_excel, "parsed_data.xlsx")
+    st.download_button("\u2B07\uFE0F Download CSV", build_csv, "parsed_data.csv", mime="text/csv")
 
-# -------------------------------- UI: Export & Edit ---------------------------
 with tab2:
     st.markdown("### \U0001F4CB Parsed Data Table \U0001F4C3")
     if all_rows_display:
-        df_display = pd.DataFrame(all_rows_display)
-
-        show_full_narrative = st.checkbox("Show full narrative (may be long)", value=True)
-        if not show_full_narrative:
-            df_display['Narrative'] = df_display['Narrative'].astype(str).str.slice(0, 1000)
-
-        preferred_order = [
-            'SL No','Date','Sender ID','Report Date','Case Age (days)','Reporter Qualification',
-            'Patient Detail','Product Detail','Event Details','Listedness','Narrative',
-            'Validity','Comment','Reportability','Parsing Warnings'
-        ]
-        df_display = df_display[[c for c in preferred_order if c in df_display.columns]]
-
-        edited_df = st.data_editor(
-            df_display,
-            num_rows="dynamic",
-            use_container_width=True,
-            disabled=df_display.columns
-        )
+        # Reuse the table built on a previous rerun while the uploads are unchanged.
+        table_key = (inputs_signature, len(all_rows_display))
+        df_full = st.session_state.get("df_display")
+        if df_full is None or st.session_state.get("df_display_key") != table_key:
+            # Transpose the row tuples into columns and type each one as it is built,
+            # rather than materializing an object frame and casting it afterwards.
+            df_full = pd.DataFrame({
+                label: pd.Series(values, dtype="string[pyarrow]" if label in STRING_COLUMNS else None)
+                for label, values in zip(OUTPUT_COLUMNS, zip(*all_rows_display))
+            })
+            st.session_state["df_display"] = df_full
+            st.session_state["df_display_key"] = table_key
 
-        excel_buffer = io.BytesIO()
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            edited_df.to_excel(writer, index=False, sheet_name="Parsed Data")
-        st.download_button("\u2B07\uFE0F Download Excel", excel_buffer.getvalue(), "parsed_data.xlsx")
+        render_parsed_table(df_full)
     else:
         st.info("No data available yet. Please upload files in the first tab.")
 